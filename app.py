@@ -20,12 +20,19 @@ def stream_planning(instruction):
         yield gr.update(), gr.update(), gr.update(), gr.update()
     else:
         yield gr.update(), gr.update(), gr.update(value=""), gr.update(value="生成段落(第1段)")
+        think = ""
         for status, think, chapter in result:
             if status == 'think':
                 yield gr.update(value=think), gr.update(), gr.update(), gr.update()
             elif status == 'output':
                 table_data = [[ch['段落'],ch['要点描述'],ch['字数要求']] for ch in chapter]
                 yield gr.update(value=think), gr.update(value=table_data), gr.update(), gr.update()
+        if agent.status != 'writing':
+            if agent.plan_check:
+                message = f"大纲未被采用: {'; '.join(agent.plan_check)}。请修改指令后重新生成大纲。"
+            else:
+                message = "生成大纲失败! 请重新生成大纲。"
+            yield gr.update(value=f"{think}<br>{message}"), gr.update(value=[]), gr.update(), gr.update()
 
 def stream_writing(think_data, table_data, text_data):
     assert agent.status == 'writing', '尚未生成大纲!'
@@ -41,11 +48,12 @@ def stream_writing(think_data, table_data, text_data):
     writer = agent.write()
     if writer == -1:
         return gr.update(), gr.update(), gr.update()
-    if agent.model_args["reasoning"] == 2:
-        for state, think, text in writer:
+    for item in writer:
+        if len(item) == 3:
+            state, think, text = item
             yield gr.update(value=original_think+think), gr.update(value=original_text+text), gr.update()
-    else:
-        for state, text in writer:
+        else:
+            state, text = item
             if state == "think":
                 yield gr.update(value=original_think+text), gr.update(), gr.update()
             elif state == "output":
@@ -74,18 +82,18 @@ def stream_writing_all(think_data, table_data, text_data):
             if writer == -1:
                 yield gr.update(), gr.update(), gr.update()
                 break
-            if agent.model_args["reasoning"] == 2:
-                curr_think, curr_text = "", ""
-                for state, think, text in writer:
+            curr_think, curr_text = "", ""
+            for item in writer:
+                if len(item) == 3:
+                    state, think, text = item
                     if not think:
                         think = ""
                     if not text:
                         text = ""
                     curr_think, curr_text = think, text
                     yield gr.update(value=original_think+think), gr.update(value=original_text+text), gr.update()
-            else:
-                curr_think, curr_text = "", ""
-                for state, text in writer:
+                else:
+                    state, text = item
                     if not text:
                         text = ""
                     if state == "think":
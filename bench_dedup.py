@@ -0,0 +1,68 @@
+import time
+import argparse
+import numpy as np
+from dedup import DedupIndex
+
+def random_chapters(n, length, seed=0, paragraph=200):
+    """Synthetic chapters made of random common CJK characters, in paragraphs of paragraph characters."""
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(0x4E00, 0x4E00 + 3000, size=(n, length), dtype=np.uint32)
+    codes[:, paragraph-1::paragraph] = ord('\n')
+    return [row.tobytes().decode("utf-32-le") for row in codes]
+
+def mutate(text, ratio, rng):
+    """Replace a ratio of the characters of text with random ones."""
+    chars = list(text)
+    positions = [i for i, char in enumerate(chars) if char != '\n']
+    for i in rng.choice(positions, size=int(len(positions) * ratio), replace=False):
+        chars[i] = chr(0x4E00 + int(rng.integers(0, 3000)))
+    return ''.join(chars)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("近似重复索引的建立和查询速度测试")
+    parser.add_argument("-n","--chapters",type=int,default=100000,help="索引中的段落数")
+    parser.add_argument("-l","--length",type=int,default=2000,help="每段的字数")
+    parser.add_argument("-q","--queries",type=int,default=1000,help="查询次数")
+    parser.add_argument("--path",type=str,default=None,help="保存索引的文件夹, 同时测试保存和载入速度")
+    args = parser.parse_args()
+    rng = np.random.default_rng(1)
+
+    start = time.time()
+    chapters = random_chapters(args.chapters, args.length)
+    print(f"生成{args.chapters}段测试文本: {time.time()-start:.1f}秒")
+
+    index = DedupIndex(path=args.path)
+    start = time.time()
+    index.add_many((f"chapter#{i}", text) for i, text in enumerate(chapters))
+    seconds = time.time() - start
+    print(f"批量建立索引: {seconds:.1f}秒, 每段{seconds/args.chapters*1000:.3f}毫秒")
+
+    if args.path:
+        start = time.time()
+        index.save()
+        print(f"保存索引: {time.time()-start:.2f}秒")
+        start = time.time()
+        index = DedupIndex.load(args.path)
+        print(f"载入索引: {time.time()-start:.2f}秒")
+
+    targets = rng.choice(args.chapters, size=args.queries, replace=False)
+    duplicates = [mutate(chapters[i], 0.05, rng) for i in targets]
+    fresh = random_chapters(args.queries, args.length, seed=2)
+    for name, texts in (("近似重复段落", duplicates), ("全新段落", fresh)):
+        latencies, hits = [], 0
+        for i, text in enumerate(texts):
+            start = time.time()
+            result = index.query(text)
+            latencies.append(time.time() - start)
+            if name == "近似重复段落":
+                hits += any(doc_id == f"chapter#{targets[i]}" for doc_id, _ in result)
+            else:
+                hits += len(result) > 0
+        latencies = np.array(latencies) * 1000
+        print(f"查询{name}: 平均{latencies.mean():.2f}毫秒, p99 {np.percentile(latencies, 99):.2f}毫秒, 命中{hits}/{len(texts)}")
+
+    start = time.time()
+    for i, text in enumerate(fresh):
+        index.add(f"new#{i}", text, persist=False)
+    seconds = time.time() - start
+    print(f"逐段增量加入{len(fresh)}段: 每段{seconds/len(fresh)*1000:.2f}毫秒")
@@ -0,0 +1,115 @@
+import os
+import json
+import random
+import tempfile
+import jsonlines
+from core import load_config
+from core_batch import BatchWriter, LocalBatchClient, canned_responder
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+def make_check_config(config="configs/deepseek-r1.yaml", **overrides):
+    """Config writing into a new temporary folder with the canned local endpoint. Returns (work folder, config)."""
+    config = load_config(os.path.join(ROOT, config))
+    work = tempfile.mkdtemp(prefix="check_batch_")
+    config = {**config,
+              "prompt_template":{key:os.path.join(ROOT, path) for key, path in config["prompt_template"].items()},
+              "save_path":os.path.join(work, "generated_texts"),
+              "batch":{"endpoint":"local","responder":"canned","local_path":os.path.join(work, "batch_local"),"poll_interval":0},
+              **overrides}
+    return work, config
+
+def read_log(novel):
+    with jsonlines.open(os.path.join(novel.work_folder, "log.jsonl")) as f:
+        return list(f)
+
+def check_batch():
+    """Run BatchWriter offline through plan, write and repair rounds with the canned local endpoint.
+
+    Only the write stage is configured, so the repair stage falls back to model_args.
+    """
+    work, config = make_check_config(stages={"write":{"model":"deepseek-chat","reasoning":0}},
+                                     cascade={"min_ratio":1.1})
+    writer = BatchWriter(config)
+    writer.plan_and_write(["第一条测试指令", "第二条测试指令"])
+    assert len(writer.writers) == 2, "小说数错误!"
+    for novel in writer.writers:
+        with open(os.path.join(novel.work_folder, "stop.txt"), 'r', encoding='utf-8') as f:
+            assert f.read() == "2", f"{novel.work_folder} 未写完!"
+        with open(os.path.join(novel.work_folder, "fulltext.txt"), 'r', encoding='utf-8') as f:
+            fulltext = f.read()
+        assert "deepseek-reasoner" in fulltext and "deepseek-chat" not in fulltext, "未使用repair阶段的模型重新生成!"
+        assert len([record for record in read_log(novel) if "check" in record]) == 2, "未记录未通过检查的段落!"
+        with open(os.path.join(novel.work_folder, "stats.json"), 'r', encoding='utf-8') as f:
+            stats = json.load(f)
+        assert all(stats[stage]["calls"] > 0 for stage in ("plan", "write", "repair")), f"{novel.work_folder} 的stats.json错误!"
+    for stage in ("plan", "write", "repair"):
+        assert writer.stats.stats[stage]["calls"] > 0 and writer.stats.stats[stage]["total_tokens"] > 0, f"{stage}阶段统计错误!"
+    print(f"批处理检查通过! 输出位于 {work}")
+
+def check_resume():
+    """Interrupt a novel after its first chapter and resume it: the resumed write prompt must contain the first chapter."""
+    work, config = make_check_config()
+    canned = canned_responder()
+    def fail_second_chapter(request):
+        if request["custom_id"].endswith("-1"):
+            raise ValueError("模拟第2段生成失败")
+        return canned(request)
+    client = LocalBatchClient(root=config["batch"]["local_path"], responder=fail_second_chapter)
+    writer = BatchWriter(config, client=client)
+    writer.plan_and_write(["续写测试指令"])
+    novel = writer.writers[0]
+    with open(os.path.join(novel.work_folder, "stop.txt"), 'r', encoding='utf-8') as f:
+        assert f.read() == "1", "未在第2段中断!"
+    first = [record for record in read_log(novel) if record.get("chapter") == 0][0]["output"]
+    resumed = BatchWriter(config)
+    resumed.continue_from_stop([novel.timestamp])
+    second = [record for record in read_log(novel) if record.get("chapter") == 1]
+    assert len(second) == 1, "续写失败!"
+    assert first in second[0]["input"][0]["content"], "续写的提示词中没有已经写好的段落!"
+    print(f"续写检查通过! 输出位于 {work}")
+
+def random_text(seed, length=800, paragraph=200):
+    """Random common CJK characters in paragraphs of paragraph characters, the same for the same seed."""
+    rng = random.Random(seed)
+    return '\n'.join(''.join(chr(0x4E00 + rng.randrange(3000)) for _ in range(paragraph)) for _ in range(length // paragraph))
+
+def check_dedup():
+    """Two novels get the same plan and the same chapters in the same batches.
+
+    The first answer to every request only depends on what is requested (the plan or
+    the chapter number); later answers to the same custom_id are unique. The second
+    novel's plan must therefore be generated again and both of its chapters repaired.
+    """
+    work, config = make_check_config()
+    config["dedup"] = {"index_path":os.path.join(work, "dedup_index"),"sampled_path":os.path.join(work, "sampled_texts")}
+    answered = set()
+    def respond(request):
+        custom_id = request["custom_id"]
+        kind = custom_id.split('-')[-1]
+        seed = custom_id if custom_id in answered else kind
+        answered.add(custom_id)
+        if kind == "plan":
+            content = '\n'.join([f"第 {i} 段 - 要点：{random_text(f'{seed}-{i}', 50, 50)} - 字数：800字" for i in (1, 2)])
+        else:
+            content = random_text(seed)
+        return {"choices":[{"index":0,"message":{"role":"assistant","content":content}}]}
+    writer = BatchWriter(config, client=LocalBatchClient(root=config["batch"]["local_path"], responder=respond))
+    writer.plan_and_write(["第一条测试指令", "第二条测试指令"])
+    first, second = writer.writers
+    for novel in writer.writers:
+        with open(os.path.join(novel.work_folder, "stop.txt"), 'r', encoding='utf-8') as f:
+            assert f.read() == "2", f"{novel.work_folder} 未写完!"
+    assert not any("check" in record for record in read_log(first)), "第一部小说不应被判定为重复!"
+    checks = [record for record in read_log(second) if "check" in record]
+    assert len([record for record in checks if "chapter" not in record and record["output"].startswith("第 1 段")]) == 1, "重复的大纲未重新生成!"
+    assert len(checks) == 3, "同一批次中重复的段落未重新生成!"
+    with open(os.path.join(second.work_folder, "fulltext.txt"), 'r', encoding='utf-8') as f:
+        fulltext = f.read()
+    assert random_text("0") not in fulltext and random_text("1") not in fulltext, "保留了重复的段落!"
+    print(f"近似重复检查通过! 输出位于 {work}")
+
+if __name__ == "__main__":
+    check_batch()
+    check_resume()
+    check_dedup()
@@ -0,0 +1,517 @@
+import re
+import os
+import time
+import json
+import datetime
+import itertools
+import yaml
+import jsonlines
+from openai import OpenAI
+
+def separate_thoughts_and_output(text):
+    thought_process = re.findall(r'<think>(.*?)</think>', text, re.DOTALL)
+    output = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
+    if len(thought_process) == 0:
+        return "", output.strip()
+    return thought_process[0], output.strip()
+
+def check_empty_peek_first(generator):
+    try:
+        first = next(generator)
+        return False, first
+    except StopIteration:
+        return True, None
+
+def get_utc_timestamp():
+    return round(datetime.datetime.now().timestamp() * 1000000)
+
+def split_plan(text):
+    plan_list = [item for item in text.split('\n') if len(item)>0 and re.match(r"^第\s?\d+\s?段.*", item)]
+    return plan_list
+
+def get_author(model_args):
+    return {"base_url":model_args["base_url"],"model":model_args["model"],"reasoning":model_args["reasoning"]}
+
+def make_result(messages, model_args, think, output, usage=None):
+    """Build the record written to log.jsonl. Non-reasoning models (reasoning==0) have no think field."""
+    if model_args['reasoning'] in (1, 2):
+        result = {"input":messages,"author":get_author(model_args),"think":think,"output":output}
+    else:
+        result = {"input":messages,"author":get_author(model_args),"output":output}
+    if usage:
+        result["usage"] = usage
+    return result
+
+def dump_usage(usage):
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage
+    return usage.model_dump()
+
+def parse_message(content, reasoning_content, model_args):
+    """Split a complete assistant message into (think, output) according to model_args['reasoning']."""
+    if content is None:
+        content = ""
+    if model_args['reasoning'] == 1:
+        return reasoning_content, content
+    elif model_args['reasoning'] == 2:
+        return separate_thoughts_and_output(content)
+    else:
+        return None, content
+
+def create_completion(messages, model_args, stream=False):
+    client = OpenAI(api_key=model_args['api_key'], base_url=model_args['base_url'])
+    if stream:
+        return client.chat.completions.create(
+            model=model_args['model'],
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+    return client.chat.completions.create(
+        model=model_args['model'],
+        messages=messages,
+        stream=False
+    )
+
+def chat(messages, model_args, max_retries=10, pause=20):
+    """Blocking back end: return a log record, or -1 when max_retries is exceeded."""
+    i = 0
+    while i < max_retries:
+        try:
+            response = create_completion(messages, model_args, stream=False)
+            message = response.choices[0].message
+            think, output = parse_message(message.content, getattr(message, "reasoning_content", None), model_args)
+            return make_result(messages, model_args, think, output, dump_usage(getattr(response, "usage", None)))
+        except Exception as e:
+            #Handle API error here
+            print(f"Error: {e}")
+            i += 1
+            time.sleep(pause)
+    print('Max retries exceeded.')
+    return -1
+
+def stream(messages, model_args, max_retries=10, pause=20):
+    """Streaming back end: yield {'think': ...} and {'output': ...} chunks, and {'usage': ...} if the api reports it."""
+    i = 0
+    while i < max_retries:
+        try:
+            response = create_completion(messages, model_args, stream=True)
+            is_empty, first_chunk = check_empty_peek_first(response)
+            if is_empty:
+                raise ValueError("response is empty.")
+            else:
+                response = itertools.chain([first_chunk],response)
+            for chunk in response:
+                if getattr(chunk, "usage", None):
+                    yield {'usage': dump_usage(chunk.usage)}
+                if not chunk.choices:
+                    continue
+                if hasattr(chunk.choices[0].delta, "reasoning_content") and chunk.choices[0].delta.reasoning_content:
+                    reasoning_content = chunk.choices[0].delta.reasoning_content
+                    if not reasoning_content:
+                        reasoning_content = ""
+                    yield {'think': reasoning_content}
+                else:
+                    content = chunk.choices[0].delta.content
+                    if not content:
+                        content = ""
+                    yield {'output': content}
+            break
+        except Exception as e:
+            #Handle API error here
+            print(f"Error: {e}")
+            i += 1
+            time.sleep(pause)
+    if i >= max_retries:
+        print('Max retries exceeded.')
+        return -1
+
+def count_words(text):
+    """Count words the way the plan's 字数 does: every non-whitespace character."""
+    return len(re.sub(r"\s", "", text))
+
+def get_word_requirement(plan_line):
+    wordcount = re.search(r"字数[:：]?\s*(\d+)\s*字", plan_line)
+    if not wordcount:
+        wordcount = re.search(r"(\d+)\s*字\s*$", plan_line)
+    if not wordcount:
+        return None
+    return int(wordcount.group(1))
+
+def repeat_ratio(text):
+    """Fraction of sentences (at least 5 characters long) that already appeared earlier in the text."""
+    sentences = [item.strip() for item in re.split(r"[。！？!?\n]", text) if len(item.strip()) >= 5]
+    if len(sentences) == 0:
+        return 0
+    return 1 - len(set(sentences)) / len(sentences)
+
+def check_chapter(output, plan_line, min_ratio=0.5, max_ratio=1.5, max_repeat_ratio=0.2):
+    """Cheap local checks of a written chapter. Returns a list of problems, empty if the chapter passes."""
+    problems = []
+    if not output or len(output.strip()) == 0:
+        return ["输出为空"]
+    target = get_word_requirement(plan_line)
+    if target:
+        words = count_words(output)
+        if words < target * min_ratio or words > target * max_ratio:
+            problems.append(f"字数{words}不在要求{target}字的范围内")
+    ratio = repeat_ratio(output)
+    if ratio > max_repeat_ratio:
+        problems.append(f"重复句子比例{ratio:.0%}")
+    return problems
+
+class StageStats:
+    """Latency and token totals per stage (plan, write, repair)."""
+    def __init__(self):
+        self.stats = {}
+
+    def add(self, stage, seconds, usage=None, calls=1):
+        item = self.stats.setdefault(stage, {"calls":0,"seconds":0.0,"prompt_tokens":0,"completion_tokens":0,"reasoning_tokens":0,"total_tokens":0})
+        item["calls"] += calls
+        item["seconds"] += seconds
+        if usage:
+            item["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            item["completion_tokens"] += usage.get("completion_tokens") or 0
+            item["total_tokens"] += usage.get("total_tokens") or 0
+            details = usage.get("completion_tokens_details") or {}
+            item["reasoning_tokens"] += details.get("reasoning_tokens") or 0
+
+    def report(self):
+        lines = ["阶段\t调用次数\t耗时(秒)\t输入tokens\t输出tokens\t思考tokens"]
+        for stage, item in self.stats.items():
+            lines.append(f"{stage}\t{item['calls']}\t{item['seconds']:.1f}\t{item['prompt_tokens']}\t{item['completion_tokens']}\t{item['reasoning_tokens']}")
+        return '\n'.join(lines)
+
+    def save(self, path):
+        with open(path,'w',encoding='utf-8') as f:
+            json.dump(self.stats, f, ensure_ascii=False, indent=4)
+
+def load_config(config):
+    """Load a yaml configuration file. A dict is returned unchanged."""
+    if isinstance(config, dict):
+        return config
+    try:
+        with open(config,"r",encoding="utf-8") as f:
+            return yaml.safe_load(f)
+    except FileNotFoundError as e:
+        print(f"Error: {e}. \nConfiguration file {config} not found.")
+        raise
+
+STAGES = ("plan", "write", "repair")
+
+def get_stage_args(config):
+    """Model arguments of every stage: model_args updated by the stage's entry in the stages section."""
+    stages = config.get("stages") or {}
+    return {stage:{**config["model_args"], **(stages.get(stage) or {})} for stage in STAGES}
+
+def get_check_cascade(config):
+    """Whether written chapters are checked and failing ones written again with the repair model.
+
+    True when a repair stage is configured, or when the write stage uses another model
+    than the repair stage (e.g. only stages.write is set to a fast model).
+    """
+    if "repair" in (config.get("stages") or {}):
+        return True
+    stage_args = get_stage_args(config)
+    return any(stage_args["write"][key] != stage_args["repair"][key] for key in ("base_url", "model"))
+
+def get_cascade(config):
+    return {"min_ratio":0.5, "max_ratio":1.5, "max_repeat_ratio":0.2, **(config.get("cascade") or {})}
+
+class BaseWriter:
+    """Configuration, prompts and on-disk bookkeeping shared by all execution back ends.
+
+    Subclasses implement make_plan() and write() on top of a back end and hand
+    the finished records to accept_plan() and accept_chapter().
+
+    Every stage in STAGES uses model_args unless the optional stages section of the
+    config overrides it. When a repair stage is configured or the write stage uses another
+    model, a written chapter that fails check_chapter() is written again with the repair model.
+
+    With a dedup section in the config, plans and chapters are also checked against
+    the near-duplicate index of dedup.py: a duplicated plan is generated again, up to
+    plan_attempts times, and a duplicated chapter is written again like a failed check.
+    """
+    def __init__(self, config="configs/deepseek-r1.yaml"):
+        self.config = load_config(config)
+        if "prompt_template" not in self.config:
+            raise ValueError("Prompt template not found.")
+        try:
+            with open(self.config["prompt_template"]["template_plan"],'r',encoding='utf-8') as f:
+                self.template_plan = f.read()
+        except FileNotFoundError as e:
+            print(f"Error: {e}. \nPrompt template file {self.config['prompt_template']['template_plan']} not found.")
+        try:
+            with open(self.config["prompt_template"]["template_write"],'r',encoding='utf-8') as f:
+                self.template_write = f.read()
+        except FileNotFoundError as e:
+            print(f"Error: {e}. \nPrompt template file {self.config['prompt_template']['template_write']} not found.")
+        if "model_args" not in self.config:
+            raise ValueError("Model arguments not found.")
+        self.model_args = self.config["model_args"]
+        self.stage_args = get_stage_args(self.config)
+        if "dedup" in self.config:
+            from dedup import load_indexes
+            self.dedup = load_indexes(self.config)
+            self.plan_attempts = self.config["dedup"].get("plan_attempts", 3)
+        else:
+            self.dedup = None
+            self.plan_attempts = 1
+        self.check_cascade = get_check_cascade(self.config)
+        self.escalate = self.check_cascade or self.dedup is not None
+        self.cascade = get_cascade(self.config)
+        self.stats = StageStats()
+        if "retry" in self.config:
+            if "max_retries" in self.config["retry"]:
+                self.max_retries = self.config["retry"]["max_retries"]
+            else:
+                self.max_retries = 10
+            if "pause" in self.config["retry"]:
+                self.pause = self.config["retry"]["pause"]
+            else:
+                self.pause = 20
+        else:
+            self.max_retries = 10
+            self.pause = 20
+        if "save_path" in self.config:
+            self.save_path = self.config["save_path"]
+        else:
+            self.save_path = "generated_texts"
+        if "word_requirement" in self.config:
+            self.min_word = self.config["word_requirement"]["min_word"]
+            self.max_word = self.config["word_requirement"]["max_word"]
+            self.sample_1 = self.config["word_requirement"]["sample_1"]
+            self.sample_2 = self.config["word_requirement"]["sample_2"]
+            assert self.min_word < min(self.sample_1, self.sample_2) < max(self.sample_1, self.sample_2) < self.max_word, "字数设置错误!"
+        else:
+            self.min_word = 500
+            self.max_word = 3000
+            self.sample_1 = 800
+            self.sample_2 = 2000
+        self.status = 'setting'
+
+    def build_prompts(self, instruction):
+        self.instruction = instruction
+        prompt_plan = self.template_plan.replace("$INST$",instruction)
+        prompt_plan = prompt_plan.replace("$MIN_WORDS$",str(self.min_word)).replace("$MAX_WORDS$",str(self.max_word))
+        prompt_plan = prompt_plan.replace("$SAMPLE_1$",str(self.sample_1)).replace("$SAMPLE_2$",str(self.sample_2))
+        self.prompt_plan = prompt_plan
+        self.prompt_write = self.template_write.replace("$INST$",instruction)
+        self.plan_check = []
+
+    def set_instruction(self, instruction):
+        self.build_prompts(instruction)
+        timestamp = get_utc_timestamp()
+        while os.path.exists(os.path.join(self.save_path, f"generate_{timestamp}")):
+            timestamp += 1
+        self.timestamp = timestamp
+        self.work_folder = os.path.join(self.save_path, f"generate_{timestamp}")
+        os.makedirs(self.work_folder,exist_ok=True)
+        with open(os.path.join(self.work_folder,"instruction.txt"),"w",encoding="utf-8") as f:
+            f.write(instruction)
+        self.status = 'planning'
+
+    def save_stop(self, code):
+        """Record where the job stopped. stats.json is saved along with it, so it is kept even if the job ends early."""
+        with open(os.path.join(self.work_folder,'stop.txt'),'w',encoding='utf-8') as f:
+            f.write(str(code))
+        self.save_stats()
+
+    def log(self, result):
+        with jsonlines.open(os.path.join(self.work_folder,"log.jsonl"),'a') as f:
+            f.write(result)
+
+    def call_stage(self, stage, messages):
+        """Blocking call with the model of the given stage. Returns a log record or -1."""
+        start = time.time()
+        result = chat(messages, self.stage_args[stage], self.max_retries, self.pause)
+        self.stats.add(stage, time.time() - start, result.get("usage") if result != -1 else None)
+        return result
+
+    def find_duplicates(self, kind, text):
+        """Near-duplicates of text among the indexed plans or chapters, other than this work folder's own."""
+        if self.dedup is None:
+            return []
+        return self.dedup[kind].query(text, exclude=self.work_folder + "#")
+
+    def check_output(self, output):
+        problems = []
+        if self.check_cascade:
+            problems = check_chapter(output, self.plan_list[self.curr_chapter], **self.cascade)
+        duplicates = self.find_duplicates("chapters", output)
+        if len(duplicates) > 0:
+            problems.append(f"与{duplicates[0][0]}近似重复(相似度{duplicates[0][1]:.2f})")
+        return problems
+
+    def save_stats(self):
+        if len(self.stats.stats) > 0:
+            self.stats.save(os.path.join(self.work_folder, "stats.json"))
+
+    def report_stats(self):
+        print(self.stats.report())
+        self.save_stats()
+
+    def plan_messages(self):
+        return [{"role":"user","content":self.prompt_plan}]
+
+    def write_messages(self):
+        curr_write_prompt = self.prompt_write.replace("$PLAN$",self.plan_text).replace("$TEXT$",self.written).replace("$STEP$",self.plan_list[self.curr_chapter])
+        return [{"role":"user","content":curr_write_prompt}]
+
+    def accept_plan(self, result):
+        """Save a generated plan. Returns -1 if the plan is a near-duplicate and is rejected, otherwise 0.
+
+        A rejected plan is logged and stop.txt is set to -1, so the plan is generated again if
+        the job ends before a later attempt is accepted.
+        """
+        duplicates = self.find_duplicates("plans", result["output"])
+        if len(duplicates) > 0:
+            print(f"大纲与{duplicates[0][0]}近似重复(相似度{duplicates[0][1]:.2f}), 未被采用!")
+            result["check"] = [f"与{duplicates[0][0]}近似重复(相似度{duplicates[0][1]:.2f})"]
+            self.plan_check = result["check"]
+            self.log(result)
+            self.save_stop(-1)
+            return -1
+        self.log(result)
+        self.plan_text = result["output"]
+        with open(os.path.join(self.work_folder,"plan.txt"),'w',encoding='utf-8') as f:
+            f.write(self.plan_text)
+        self.plan_list = split_plan(self.plan_text)
+        self.status = "writing"
+        self.N_chapters = len(self.plan_list)
+        self.curr_chapter = 0
+        self.written = ""
+        self.save_stop(0)
+        if self.dedup is not None:
+            self.dedup["plans"].add(f"{self.work_folder}#plan", self.plan_text)
+        print("生成大纲成功!")
+        return 0
+
+    def accept_chapter(self, result):
+        result["chapter"] = self.curr_chapter
+        self.log(result)
+        with open(os.path.join(self.work_folder, "fulltext.txt"),'a',encoding='utf-8') as f:
+            f.write(f'{result["output"]}\n\n')
+        self.written += f'{result["output"]}\n\n'
+        if self.dedup is not None:
+            self.dedup["chapters"].add(f"{self.work_folder}#{self.curr_chapter}", result["output"])
+        print(f"第{self.curr_chapter+1}段生成成功!")
+        self.curr_chapter += 1
+        self.save_stop(self.curr_chapter)
+
+    def load_from_stop(self, timestamp):
+        """Restore a work folder written by an earlier run. Returns the code stored in stop.txt."""
+        self.timestamp = timestamp
+        self.work_folder = os.path.join(self.save_path, f"generate_{timestamp}")
+        try:
+            with open(os.path.join(self.work_folder,"instruction.txt"),"r",encoding="utf-8") as f:
+                instruction = f.read()
+        except FileNotFoundError as e:
+            print(f"Error: {e}. \ninstruction.txt not found.")
+            raise
+        self.build_prompts(instruction)
+        with open(os.path.join(self.work_folder,'stop.txt'),'r',encoding='utf-8') as f:
+            code = int(f.read())
+        if code == -1:
+            self.status = "planning"
+        else:
+            self.status = "writing"
+            self.curr_chapter = code
+            try:
+                with open(os.path.join(self.work_folder,"plan.txt"),"r",encoding="utf-8") as f:
+                    self.plan_text = f.read()
+            except FileNotFoundError as e:
+                print(f"Error: {e}. \nplan.txt not found.")
+            if os.path.exists(os.path.join(self.work_folder,"fulltext.txt")):
+                with open(os.path.join(self.work_folder,"fulltext.txt"),"r",encoding="utf-8") as f:
+                    self.written = f.read()
+            else:
+                self.written = ""
+            self.plan_list = split_plan(self.plan_text)
+            self.N_chapters = len(self.plan_list)
+        return code
+
+class AgentWriter(BaseWriter):
+    """Blocking execution back end."""
+    def make_plan(self):
+        if self.status == 'setting':
+            print("未设定写作指令!")
+            return -1
+        elif self.status == 'writing':
+            print("检测到已生成的大纲，跳过中...")
+            return 0
+        elif self.status == 'planning':
+            print(f"正在为以下写作任务制定大纲：\n{self.instruction}\n")
+            messages = self.plan_messages()
+            for attempt in range(self.plan_attempts):
+                if attempt > 0:
+                    print(f"重新生成大纲(第{attempt+1}次)...")
+                planning_result = self.call_stage("plan", messages)
+                if planning_result == -1:
+                    print("大纲生成失败!")
+                    self.save_stop(-1)
+                    return -1
+                if self.accept_plan(planning_result) == 0:
+                    return 0
+            print(f"大纲连续{self.plan_attempts}次近似重复, 已中止!")
+            return -1
+
+    def write(self):
+        assert self.status == "writing", "未找到写作大纲!"
+        if self.curr_chapter >= self.N_chapters:
+            print(f"写作已完成, 停止生成! 章节数 : {self.N_chapters}")
+            return -1
+        else:
+            print(f"正在写作第{self.curr_chapter+1}段:\n{self.plan_list[self.curr_chapter]}")
+            messages = self.write_messages()
+            try:
+                result = self.call_stage("write", messages)
+                if result == -1:
+                    print(f"第{self.curr_chapter+1}段生成失败!")
+                    self.save_stop(self.curr_chapter)
+                    return -1
+                if self.escalate:
+                    result = self.repair(messages, result)
+            except KeyboardInterrupt as e:
+                print(f"第{self.curr_chapter+1}段生成被用户中止!")
+                self.save_stop(self.curr_chapter)
+                return -1
+            self.accept_chapter(result)
+            return 0
+
+    def repair(self, messages, result):
+        problems = self.check_output(result["output"])
+        if len(problems) == 0:
+            return result
+        print(f"第{self.curr_chapter+1}段未通过检查({'; '.join(problems)}), 使用{self.stage_args['repair']['model']}重新生成...")
+        result["check"] = problems
+        self.log(result)
+        repaired = self.call_stage("repair", messages)
+        if repaired == -1:
+            print(f"第{self.curr_chapter+1}段重新生成失败, 保留原结果!")
+            return result
+        return repaired
+
+    def write_all(self):
+        while self.curr_chapter < self.N_chapters:
+            code_w = self.write()
+            if code_w == -1:
+                break
+        self.report_stats()
+
+    def plan_and_write(self, instruction):
+        self.set_instruction(instruction)
+        code = self.make_plan()
+        if code == 0:
+            self.write_all()
+
+    def continue_from_stop(self, timestamp):
+        code = self.load_from_stop(timestamp)
+        if code == -1:
+            code_p = self.make_plan()
+            if code_p == 0:
+                self.write_all()
+        else:
+            self.write_all()
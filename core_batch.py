@@ -0,0 +1,365 @@
+import os
+import json
+import time
+import argparse
+import jsonlines
+from openai import OpenAI
+from core import BaseWriter, StageStats, STAGES, load_config, get_stage_args, get_check_cascade, create_completion, parse_message, make_result, get_utc_timestamp
+
+TERMINAL_STATUS = ("completed", "failed", "expired", "cancelled")
+
+def make_batch_request(custom_id, messages, model_args):
+    return {"custom_id":custom_id,"method":"POST","url":"/v1/chat/completions","body":{"model":model_args["model"],"messages":messages}}
+
+def parse_batch_line(line, model_args):
+    """Return (think, output, usage) for a line of a batch output file, or None if the request failed."""
+    if line.get("error") or not line.get("response"):
+        return None
+    if line["response"].get("status_code") != 200:
+        return None
+    body = line["response"]["body"]
+    message = body["choices"][0]["message"]
+    think, output = parse_message(message.get("content"), message.get("reasoning_content"), model_args)
+    return think, output, body.get("usage")
+
+class OpenAIBatchClient:
+    """Batch API of OpenAI compatible providers (files + batches endpoints)."""
+    def __init__(self, model_args, completion_window="24h"):
+        self.client = OpenAI(api_key=model_args['api_key'], base_url=model_args['base_url'])
+        self.completion_window = completion_window
+
+    def submit(self, batch_file):
+        with open(batch_file, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.completion_window
+        )
+        return batch.id
+
+    def retrieve(self, batch_id):
+        """Return (status, lines). lines is only filled in once status is terminal."""
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status not in TERMINAL_STATUS:
+            return batch.status, []
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = self.client.files.content(file_id).text
+                lines += [json.loads(line) for line in content.split('\n') if len(line.strip())>0]
+        return batch.status, lines
+
+def live_responder(model_args_list):
+    """Answer batch requests of the local endpoint with the real-time chat completions api.
+
+    The base_url and api_key are taken from the first entry of model_args_list whose
+    model is the model of the request, falling back to the first entry.
+    """
+    def respond(request):
+        body = request["body"]
+        model_args = next((item for item in model_args_list if item["model"] == body["model"]), model_args_list[0])
+        response = create_completion(body["messages"], {**model_args, "model":body["model"]}, stream=False)
+        return response.model_dump()
+    return respond
+
+CANNED_WORDS = 800
+
+def canned_responder():
+    """Answer batch requests of the local endpoint offline, for testing without an api key or network.
+
+    Plan requests get a two chapter plan of CANNED_WORDS words each; write requests get
+    CANNED_WORDS words of distinct sentences naming the request and the model.
+    """
+    def respond(request):
+        body = request["body"]
+        if request["custom_id"].endswith("-plan"):
+            content = '\n'.join([f"第 {i} 段 - 要点：测试段落{i} - 字数：{CANNED_WORDS}字" for i in (1, 2)])
+        else:
+            content, i = "", 0
+            while len(content) < CANNED_WORDS:
+                i += 1
+                content += f"{request['custom_id']}由{body['model']}写的第{i}句。"
+        prompt_tokens = sum(len(message["content"]) for message in body["messages"])
+        usage = {"prompt_tokens":prompt_tokens,"completion_tokens":len(content),"total_tokens":prompt_tokens+len(content)}
+        return {"choices":[{"index":0,"message":{"role":"assistant","content":content}}],"usage":usage}
+    return respond
+
+class LocalBatchClient:
+    """File-based stand-in for a provider batch endpoint, for testing.
+
+    Every batch is a folder under root holding input.jsonl, output.jsonl and status.json.
+    Requests are answered by responder(request) -> chat completion dict. With auto_process
+    the batch is answered on the first retrieve(); otherwise run serve() in another process.
+    """
+    def __init__(self, root="batch_local", responder=None, auto_process=True):
+        self.root = root
+        self.responder = responder
+        self.auto_process = auto_process
+        os.makedirs(self.root, exist_ok=True)
+
+    def set_status(self, batch_id, status):
+        with open(os.path.join(self.root, batch_id, "status.json"), 'w', encoding='utf-8') as f:
+            json.dump({"id":batch_id,"status":status}, f)
+
+    def get_status(self, batch_id):
+        with open(os.path.join(self.root, batch_id, "status.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)["status"]
+
+    def submit(self, batch_file):
+        batch_id = f"batch_local_{get_utc_timestamp()}"
+        os.makedirs(os.path.join(self.root, batch_id))
+        with open(batch_file, 'r', encoding='utf-8') as f_in, open(os.path.join(self.root, batch_id, "input.jsonl"), 'w', encoding='utf-8') as f_out:
+            f_out.write(f_in.read())
+        self.set_status(batch_id, "validating")
+        return batch_id
+
+    def process(self, batch_id):
+        self.set_status(batch_id, "in_progress")
+        with jsonlines.open(os.path.join(self.root, batch_id, "input.jsonl")) as requests:
+            requests = list(requests)
+        with jsonlines.open(os.path.join(self.root, batch_id, "output.jsonl"), 'w') as f:
+            for i, request in enumerate(requests):
+                line = {"id":f"{batch_id}_{i}","custom_id":request["custom_id"],"response":None,"error":None}
+                try:
+                    line["response"] = {"status_code":200,"request_id":line["id"],"body":self.responder(request)}
+                except Exception as e:
+                    print(f"Error: {e}")
+                    line["error"] = {"code":"local_error","message":str(e)}
+                f.write(line)
+        self.set_status(batch_id, "completed")
+
+    def process_pending(self):
+        for batch_id in sorted(os.listdir(self.root)):
+            if os.path.exists(os.path.join(self.root, batch_id, "status.json")) and self.get_status(batch_id) == "validating":
+                print(f"正在处理批任务 {batch_id}")
+                self.process(batch_id)
+
+    def serve(self, interval=5):
+        while True:
+            self.process_pending()
+            time.sleep(interval)
+
+    def retrieve(self, batch_id):
+        status = self.get_status(batch_id)
+        if status == "validating" and self.auto_process:
+            self.process(batch_id)
+            status = self.get_status(batch_id)
+        if status not in TERMINAL_STATUS:
+            return status, []
+        with jsonlines.open(os.path.join(self.root, batch_id, "output.jsonl")) as f:
+            return status, list(f)
+
+def make_batch_client(config, model_args=None):
+    """Batch client for the model_args of one stage. Without model_args a local endpoint serves the models of all stages."""
+    batch_config = config.get("batch", {})
+    endpoint = batch_config.get("endpoint", "openai")
+    if endpoint == "local":
+        responder = batch_config.get("responder", "live")
+        if responder == "live":
+            responder = live_responder([model_args] if model_args is not None else list(get_stage_args(config).values()))
+        elif responder == "canned":
+            responder = canned_responder()
+        else:
+            raise ValueError(f"Unknown local batch responder: {responder}")
+        return LocalBatchClient(root=batch_config.get("local_path", "batch_local"),
+                                responder=responder,
+                                auto_process=batch_config.get("auto_process", True))
+    elif endpoint == "openai":
+        if model_args is None:
+            model_args = config["model_args"]
+        return OpenAIBatchClient(model_args, completion_window=batch_config.get("completion_window", "24h"))
+    else:
+        raise ValueError(f"Unknown batch endpoint: {endpoint}")
+
+def load_manifest(manifest):
+    """Read instructions from a .jsonl manifest ({"instruction": ...} per line) or a text file (one per line)."""
+    if manifest.endswith(".jsonl"):
+        with jsonlines.open(manifest) as f:
+            return [item["instruction"] for item in f]
+    with open(manifest, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if len(line.strip())>0]
+
+class BatchWriter:
+    """Batch execution back end for bulk jobs.
+
+    All plans of a manifest are sent as one batch; after that every round sends the
+    next chapter of all unfinished novels as one batch. Each novel keeps the usual
+    work folder, so an interrupted novel can be resumed by continue_from_stop() (core_batch.py
+    --continue) or by AgentWriter.continue_from_stop().
+    Every novel's stats.json counts the time its requests waited for their batch; the totals
+    of the whole run are saved to save_path/batches/stats_<timestamp>.json.
+    """
+    def __init__(self, config="configs/deepseek-r1.yaml", client=None):
+        self.config = load_config(config)
+        if "model_args" not in self.config:
+            raise ValueError("Model arguments not found.")
+        self.model_args = self.config["model_args"]
+        self.stage_args = get_stage_args(self.config)
+        self.escalate = get_check_cascade(self.config) or "dedup" in self.config
+        self.save_path = self.config.get("save_path", "generated_texts")
+        self.poll_interval = self.config.get("batch", {}).get("poll_interval", 60)
+        self.clients = {stage:client if client is not None else make_batch_client(self.config, self.stage_args[stage]) for stage in STAGES}
+        self.stats = StageStats()
+        self.writers = []
+
+    def wait(self, stage, batch_id):
+        while True:
+            status, lines = self.clients[stage].retrieve(batch_id)
+            if status in TERMINAL_STATUS:
+                print(f"批任务 {batch_id} 状态: {status}")
+                return lines
+            print(f"批任务 {batch_id} 状态: {status}, {self.poll_interval}秒后重新查询...")
+            time.sleep(self.poll_interval)
+
+    def run_batch(self, stage, messages, writers):
+        """Send {custom_id: messages} as one batch with the model of the stage. Returns {custom_id: log record or None}.
+
+        Usage is added to the run's stats and to the stats of writers[custom_id].
+        """
+        model_args = self.stage_args[stage]
+        os.makedirs(os.path.join(self.save_path, "batches"), exist_ok=True)
+        batch_file = os.path.join(self.save_path, "batches", f"batch_{get_utc_timestamp()}_{stage}.jsonl")
+        with jsonlines.open(batch_file, 'w') as f:
+            for custom_id in messages:
+                f.write(make_batch_request(custom_id, messages[custom_id], model_args))
+        start = time.time()
+        batch_id = self.clients[stage].submit(batch_file)
+        print(f"已提交批任务 {batch_id}, 请求数: {len(messages)}")
+        lines = {line["custom_id"]:line for line in self.wait(stage, batch_id)}
+        seconds = time.time() - start
+        self.stats.add(stage, seconds, calls=len(messages))
+        results = {}
+        for custom_id in messages:
+            parsed = parse_batch_line(lines[custom_id], model_args) if custom_id in lines else None
+            if parsed is None:
+                writers[custom_id].stats.add(stage, seconds)
+                results[custom_id] = None
+                continue
+            think, output, usage = parsed
+            self.stats.add(stage, 0, usage, calls=0)
+            writers[custom_id].stats.add(stage, seconds, usage)
+            results[custom_id] = make_result(messages[custom_id], model_args, think, output, usage)
+        return results
+
+    def plan_round(self, writers):
+        """Send the plans of all writers as one batch. Returns the writers that succeeded.
+
+        Plans rejected as near-duplicates are sent again as a follow-up batch, up to
+        plan_attempts times per writer.
+        """
+        succeeded, attempt = [], 0
+        while len(writers) > 0:
+            attempt += 1
+            requests = {f"{writer.timestamp}-plan":writer for writer in writers}
+            results = self.run_batch("plan", {custom_id:writer.plan_messages() for custom_id, writer in requests.items()}, requests)
+            writers = []
+            for custom_id, writer in requests.items():
+                if results[custom_id] is None:
+                    print(f"大纲生成失败! {writer.work_folder}")
+                    writer.save_stop(-1)
+                    continue
+                if writer.accept_plan(results[custom_id]) == -1:
+                    if attempt < writer.plan_attempts:
+                        writers.append(writer)
+                    else:
+                        print(f"大纲连续{writer.plan_attempts}次近似重复, 已中止! {writer.work_folder}")
+                    continue
+                succeeded.append(writer)
+            if len(writers) > 0:
+                print(f"重新生成{len(writers)}个近似重复的大纲(第{attempt+1}次)...")
+        return succeeded
+
+    def write_round(self, writers):
+        """Send the next chapter of all writers as one batch, then the chapters failing the checks as a repair batch.
+
+        Chapters passing the checks are accepted, and so added to the near-duplicate index,
+        one by one, so a chapter is also checked against the ones accepted before it in the
+        same round.
+        """
+        requests = {f"{writer.timestamp}-{writer.curr_chapter}":writer for writer in writers}
+        messages = {custom_id:writer.write_messages() for custom_id, writer in requests.items()}
+        results = self.run_batch("write", messages, requests)
+        succeeded, repair = [], {}
+        for custom_id, writer in requests.items():
+            result = results[custom_id]
+            if result is not None and self.escalate:
+                problems = writer.check_output(result["output"])
+                if len(problems) > 0:
+                    print(f"第{writer.curr_chapter+1}段未通过检查({'; '.join(problems)}): {writer.work_folder}")
+                    result["check"] = problems
+                    writer.log(result)
+                    repair[custom_id] = messages[custom_id]
+                    continue
+            if self.accept_result(writer, result):
+                succeeded.append(writer)
+        if len(repair) > 0:
+            print(f"使用{self.stage_args['repair']['model']}重新生成{len(repair)}段...")
+            for custom_id, result in self.run_batch("repair", repair, requests).items():
+                if result is None:
+                    print(f"第{requests[custom_id].curr_chapter+1}段重新生成失败, 保留原结果! {requests[custom_id].work_folder}")
+                    result = results[custom_id]
+                if self.accept_result(requests[custom_id], result):
+                    succeeded.append(requests[custom_id])
+        return succeeded
+
+    def accept_result(self, writer, result):
+        if result is None:
+            print(f"第{writer.curr_chapter+1}段生成失败! {writer.work_folder}")
+            writer.save_stop(writer.curr_chapter)
+            return False
+        writer.accept_chapter(result)
+        return True
+
+    def write_rounds(self, writers):
+        active = [writer for writer in writers if writer.curr_chapter < writer.N_chapters]
+        while len(active) > 0:
+            print(f"正在批量写作, 未完成的小说数: {len(active)}")
+            active = [writer for writer in self.write_round(active) if writer.curr_chapter < writer.N_chapters]
+        print(self.stats.report())
+        os.makedirs(os.path.join(self.save_path, "batches"), exist_ok=True)
+        self.stats.save(os.path.join(self.save_path, "batches", f"stats_{get_utc_timestamp()}.json"))
+
+    def plan_and_write(self, instructions):
+        self.writers = []
+        for instruction in instructions:
+            writer = BaseWriter(self.config)
+            writer.set_instruction(instruction)
+            self.writers.append(writer)
+        planned = self.plan_round(self.writers)
+        self.write_rounds(planned)
+
+    def continue_from_stop(self, timestamps):
+        self.writers = []
+        planning, writing = [], []
+        for timestamp in timestamps:
+            writer = BaseWriter(self.config)
+            code = writer.load_from_stop(timestamp)
+            self.writers.append(writer)
+            if code == -1:
+                planning.append(writer)
+            else:
+                writing.append(writer)
+        if len(planning) > 0:
+            writing += self.plan_round(planning)
+        self.write_rounds(writing)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("使用批处理API批量生成小说")
+    parser.add_argument("-c","--config",type=str,default="configs/deepseek-r1.yaml",help="配置文件路径")
+    parser.add_argument("-m","--manifest",type=str,help="写作指令清单 (.txt 每行一条指令, 或 .jsonl 每行一个 {\"instruction\": ...})")
+    parser.add_argument("--continue",dest="timestamps",type=int,nargs="+",help="继续生成 save_path 下的子文件夹 generate_<时间戳>, 可以指定多个时间戳")
+    parser.add_argument("--serve",action="store_true",help="作为本地批处理端点运行, 处理 batch.local_path 下待处理的批任务")
+    args = parser.parse_args()
+    if not args.serve and not args.manifest and not args.timestamps:
+        parser.error("需要使用 -m 指定写作指令清单, 使用 --continue 指定要继续生成的子文件夹, 或使用 --serve 运行本地批处理端点")
+    if args.serve:
+        config = load_config(args.config)
+        client = make_batch_client({**config, "batch":{**config.get("batch", {}), "endpoint":"local"}})
+        client.serve()
+    elif args.timestamps:
+        writer = BatchWriter(args.config)
+        writer.continue_from_stop(args.timestamps)
+    else:
+        writer = BatchWriter(args.config)
+        writer.plan_and_write(load_manifest(args.manifest))
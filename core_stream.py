@@ -1,61 +1,6 @@
-import time
 import re
-import datetime
-import os
-from openai import OpenAI
-import yaml
-import jsonlines
-import itertools
-
-def check_empty_peek_first(generator):
-    try:
-        first = next(generator)
-        return False, first
-    except StopIteration:
-        return True, None
-
-def stream(messages, model_args, max_retries=10, pause=20):
-    i = 0
-    while i < max_retries:
-        try:
-            client = OpenAI(api_key=model_args["api_key"], base_url=model_args["base_url"])
-            response = client.chat.completions.create(
-                model=model_args["model"],
-                messages=messages,
-                stream=True
-            )
-            is_empty, first_chunk = check_empty_peek_first(response)
-            if is_empty:
-                raise ValueError("response is empty.")
-            else:
-                response = itertools.chain([first_chunk],response)
-            for chunk in response:  
-                if hasattr(chunk.choices[0].delta, "reasoning_content") and chunk.choices[0].delta.reasoning_content:
-                    reasoning_content = chunk.choices[0].delta.reasoning_content
-                    if not reasoning_content:
-                        reasoning_content = ""
-                    yield {'think': reasoning_content}
-                else:
-                    content = chunk.choices[0].delta.content
-                    if not content:
-                        content = ""
-                    yield {'output': content}
-            break
-        except Exception as e:
-            #Handle API error here
-            print(f"Error: {e}")
-            i += 1
-            time.sleep(pause)
-    if i >= max_retries:
-        print('Max retries exceeded.')
-        return -1
-
-def get_utc_timestamp():
-    return round(datetime.datetime.now().timestamp() * 1000000)
-
-def split_plan(text):
-    plan_list = [item for item in text.split('\n') if len(item)>0 and re.match(r"^第\s?\d+\s?段.*", item)]
-    return plan_list
+import time
+from core import BaseWriter, stream, make_result, check_empty_peek_first, get_utc_timestamp, split_plan
 
 def parse_line(line):
     line = line.strip()
@@ -172,72 +117,11 @@ class StreamProcessorForWriting:
                             self.think = thought_process[0]
                             self.text = re.sub(r'<think>.*?</think>', '', self.buffer, flags=re.DOTALL).strip()
 
+class AgentWriter(BaseWriter):
+    """Streaming execution back end. make_plan() and write() are generators that yield partial results.
 
-class AgentWriter:
-    def __init__(self, config="configs/deepseek-r1.yaml"):
-        try:
-            with open(config,"r",encoding="utf-8") as f:
-                self.config = yaml.safe_load(f)
-        except FileNotFoundError as e:
-            print(f"Error: {e}. \nConfiguration file {config} not found.")
-        if "prompt_template" not in self.config:
-            raise ValueError("Prompt template not found.")
-        try:
-            with open(self.config["prompt_template"]["template_plan"],'r',encoding='utf-8') as f:
-                self.template_plan = f.read()
-        except FileNotFoundError as e:
-            print(f"Error: {e}. \nPrompt template file {self.config["prompt_template"]["template_plan"]} not found.")
-        try:
-            with open(self.config["prompt_template"]["template_write"],'r',encoding='utf-8') as f:
-                self.template_write = f.read()
-        except FileNotFoundError as e:
-            print(f"Error: {e}. \nPrompt template file {self.config["prompt_template"]["template_write"]} not found.")
-        if "model_args" not in self.config:
-            raise ValueError("Model arguments not found.")
-        self.model_args = self.config["model_args"]
-        if "retry" in self.config:
-            if "max_retries" in self.config["retry"]:
-                self.max_retries = self.config["retry"]["max_retries"]
-            else:
-                self.max_retries = 10
-            if "pause" in self.config["retry"]:
-                self.pause = self.config["retry"]["pause"]
-            else:
-                self.pause = 20
-        else:
-            self.max_retries = 10
-            self.pause = 20
-        if "save_path" in self.config:
-            self.save_path = self.config["save_path"]
-        else:
-            self.save_path = "generated_texts"
-        if "word_requirement" in self.config:
-            self.min_word = self.config["word_requirement"]["min_word"]
-            self.max_word = self.config["word_requirement"]["max_word"]
-            self.sample_1 = self.config["word_requirement"]["sample_1"]
-            self.sample_2 = self.config["word_requirement"]["sample_2"]
-            assert self.min_word < min(self.sample_1, self.sample_2) < max(self.sample_1, self.sample_2) < self.max_word, "字数设置错误!"
-        else:
-            self.min_word = 500
-            self.max_word = 3000
-            self.sample_1 = 800
-            self.sample_2 = 2000
-        self.status = 'setting'
-    
-    def set_instruction(self, instruction):
-        self.instruction = instruction
-        prompt_plan = self.template_plan.replace("$INST$",instruction)
-        prompt_plan = prompt_plan.replace("$MIN_WORDS$",str(self.min_word)).replace("$MAX_WORDS$",str(self.max_word))
-        prompt_plan = prompt_plan.replace("$SAMPLE_1$",str(self.sample_1)).replace("$SAMPLE_2$",str(self.sample_2))
-        self.prompt_plan = prompt_plan
-        self.prompt_write = self.template_write.replace("$INST$",instruction)
-        timestamp = get_utc_timestamp()
-        self.work_folder = os.path.join(self.save_path, f"generate_{timestamp}")
-        os.makedirs(self.work_folder,exist_ok=True)
-        with open(os.path.join(self.work_folder,"instruction.txt"),"w",encoding="utf-8") as f:
-            f.write(instruction)
-        self.status = 'planning'
-
+    write() yields (status, think, text) for models with reasoning==2 and (status, think or text) otherwise.
+    """
     def make_plan(self):
         if self.status == 'setting':
             print("未设定写作指令!")
@@ -247,45 +131,33 @@ class AgentWriter:
             return 0
         elif self.status == 'planning':
             print(f"正在为以下写作任务制定大纲：\n{self.instruction}\n")
-            messages = [{"role":"user","content":self.prompt_plan}]
-            planning_result = stream(messages, model_args=self.model_args, max_retries=self.max_retries, pause=self.pause)
-            if planning_result == -1:
-                print("大纲生成失败!")
-                with open(os.path.join(self.work_folder,'stop.txt'),'w',encoding='utf-8') as f:
-                    f.write("-1")
-                return -1
-            processor = StreamProcessorForPlanning()
-            if self.model_args['reasoning'] == 2:
-                for chunk in planning_result:
-                    processor.process_chunk_for_planning_2(chunk)
-                    yield processor.status, processor.think, processor.chapters
-            else:
+            messages = self.plan_messages()
+            model_args = self.stage_args["plan"]
+            for attempt in range(self.plan_attempts):
+                if attempt > 0:
+                    print(f"重新生成大纲(第{attempt+1}次)...")
+                start = time.time()
+                planning_result = stream(messages, model_args=model_args, max_retries=self.max_retries, pause=self.pause)
+                if planning_result == -1:
+                    print("大纲生成失败!")
+                    self.save_stop(-1)
+                    return -1
+                processor = StreamProcessorForPlanning()
+                usage = None
                 for chunk in planning_result:
-                    processor.process_chunk_for_planning(chunk)
+                    if 'usage' in chunk:
+                        usage = chunk['usage']
+                    if model_args['reasoning'] == 2:
+                        processor.process_chunk_for_planning_2(chunk)
+                    else:
+                        processor.process_chunk_for_planning(chunk)
                     yield processor.status, processor.think, processor.chapters
-            planning_result = {
-                                    "input":messages,
-                                    "author":{"base_url":self.model_args["base_url"],
-                                            "model":self.model_args["model"],
-                                            "reasoning":self.model_args["reasoning"]},
-                                    "think":processor.think, 
-                                    "output":'\n'.join([f"第 {item['段落']} 段 - 要点：{item['要点描述']} - 字数：{item['字数要求']}" for item in processor.chapters])
-                                }
-            with jsonlines.open(os.path.join(self.work_folder,"log.jsonl"),'a') as f:
-                f.write(planning_result)
-            self.plan_text = planning_result["output"]
-            with open(os.path.join(self.work_folder,"plan.txt"),'w',encoding='utf-8') as f:
-                f.write(self.plan_text)
-            self.plan_list = split_plan(self.plan_text)
-            self.status = "writing"
-            self.N_chapters = len(self.plan_list)
-            self.curr_chapter = 0
-            self.written = ""
-            with open(os.path.join(self.work_folder,'stop.txt'),'w',encoding='utf-8') as f:
-                f.write('0')
-            print("生成大纲成功!")
-            self.status = 'writing'
-            return 0
+                self.stats.add("plan", time.time() - start, usage)
+                output = '\n'.join([f"第 {item['段落']} 段 - 要点：{item['要点描述']} - 字数：{item['字数要求']}" for item in processor.chapters])
+                if self.accept_plan(make_result(messages, model_args, processor.think, output, usage)) == 0:
+                    return 0
+            print(f"大纲连续{self.plan_attempts}次近似重复, 已中止!")
+            return -1
 
     def write(self):
         assert self.status == "writing", "未找到写作大纲!"
@@ -294,46 +166,52 @@ class AgentWriter:
             return -1
         else:
             print(f"正在写作第{self.curr_chapter+1}段:\n{self.plan_list[self.curr_chapter]}")
-            curr_write_prompt = self.prompt_write.replace("$PLAN$",self.plan_text).replace("$TEXT$",self.written).replace("$STEP$",self.plan_list[self.curr_chapter])
-            messages = [{"role":"user","content":curr_write_prompt}]
+            messages = self.write_messages()
             try:
-                result = stream(messages, self.model_args, self.max_retries, self.pause)
+                result = yield from self.stream_stage("write", messages)
                 if result == -1:
                     print(f"第{self.curr_chapter+1}段生成失败!")
-                    with open(os.path.join(self.work_folder,'stop.txt'),'w',encoding='utf-8') as f:
-                        f.write(str(self.curr_chapter))
+                    self.save_stop(self.curr_chapter)
                     return -1
-                processor = StreamProcessorForWriting()
-                if self.model_args['reasoning'] == 2:
-                    for chunk in result:
-                        processor.process_chunk_for_writing_2(chunk)
-                        yield processor.status, processor.think, processor.text
-                else:
-                    for chunk in result:
-                        processor.process_chunk_for_writing(chunk)
-                        if processor.status == 'think':
-                            yield processor.status, processor.think
-                        elif processor.status == 'output':
-                            yield processor.status, processor.text
+                if self.escalate:
+                    problems = self.check_output(result["output"])
+                    if len(problems) > 0:
+                        print(f"第{self.curr_chapter+1}段未通过检查({'; '.join(problems)}), 使用{self.stage_args['repair']['model']}重新生成...")
+                        result["check"] = problems
+                        self.log(result)
+                        repaired = yield from self.stream_stage("repair", messages)
+                        if repaired == -1:
+                            print(f"第{self.curr_chapter+1}段重新生成失败, 保留原结果!")
+                        else:
+                            result = repaired
             except KeyboardInterrupt as e:
                 print(f"第{self.curr_chapter+1}段生成被用户中止!")
-                with open(os.path.join(self.work_folder,'stop.txt'),'w',encoding='utf-8') as f:
-                    f.write(str(self.curr_chapter))
+                self.save_stop(self.curr_chapter)
                 return -1
-            result = {
-                        "input":messages,
-                        "author":{"base_url":self.model_args["base_url"],
-                                "model":self.model_args["model"],
-                                "reasoning":self.model_args["reasoning"]},
-                        "think":processor.think, 
-                        "output":processor.text
-                    }
-            with jsonlines.open(os.path.join(self.work_folder,"log.jsonl"),'a') as f:
-                f.write(result)
-            with open(os.path.join(self.work_folder, "fulltext.txt"),'a',encoding='utf-8') as f:
-                f.write(f'{result['output']}\n\n')
-            self.written += f'{result['output']}\n\n'
-            print(f"第{self.curr_chapter+1}段生成成功!")
-            self.curr_chapter += 1
-            with open(os.path.join(self.work_folder,'stop.txt'),'w',encoding='utf-8') as f:
-                f.write(str(self.curr_chapter))
+            self.accept_chapter(result)
+            if self.curr_chapter >= self.N_chapters:
+                self.report_stats()
+
+    def stream_stage(self, stage, messages):
+        """Stream one chapter with the model of the given stage. Returns the log record, or -1."""
+        model_args = self.stage_args[stage]
+        start = time.time()
+        result = stream(messages, model_args, self.max_retries, self.pause)
+        if result == -1:
+            return -1
+        processor = StreamProcessorForWriting()
+        usage = None
+        for chunk in result:
+            if 'usage' in chunk:
+                usage = chunk['usage']
+            if model_args['reasoning'] == 2:
+                processor.process_chunk_for_writing_2(chunk)
+                yield processor.status, processor.think, processor.text
+            else:
+                processor.process_chunk_for_writing(chunk)
+                if processor.status == 'think':
+                    yield processor.status, processor.think
+                elif processor.status == 'output':
+                    yield processor.status, processor.text
+        self.stats.add(stage, time.time() - start, usage)
+        return make_result(messages, model_args, processor.think, processor.text, usage)
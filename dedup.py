@@ -0,0 +1,291 @@
+import os
+import re
+import json
+import argparse
+import yaml
+import jsonlines
+import numpy as np
+
+def shingle_hashes(text, k=5):
+    """Unique 64-bit hashes of the character k-grams of text, whitespace removed."""
+    text = re.sub(r"\s", "", text)
+    if len(text) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    k = min(k, len(text))
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    n = len(codes) - k + 1
+    hashes = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        hashes = hashes * np.uint64(1099511628211) + codes[j:j+n]
+    return np.unique(hashes)
+
+def split_chunks(text, size=1000):
+    """Group paragraphs of a text into windows of about size characters.
+
+    A short tail is merged into the previous window, so no window is much smaller than size/2
+    unless the whole text is.
+    """
+    chunks, buffer = [], ""
+    for paragraph in text.split('\n'):
+        if len(paragraph.strip()) == 0:
+            continue
+        buffer += paragraph + '\n'
+        if len(buffer) >= size:
+            chunks.append(buffer)
+            buffer = ""
+    if len(buffer.strip()) > 0:
+        if len(chunks) > 0 and len(buffer) < size / 2:
+            chunks[-1] += buffer
+        else:
+            chunks.append(buffer)
+    return chunks
+
+class DedupIndex:
+    """MinHash signatures with an LSH band index for near-duplicate queries.
+
+    Documents and queries are both cut into windows of about chunk_size characters by
+    split_chunks(), and every window is indexed under its document id, so a chapter is
+    compared with windows of similar length. Signatures are num_perm minimums of
+    multiply-shift hashes of the shingles. They are cut into bands of num_perm // bands
+    rows, and every band is hashed to one key. A window is a candidate if any band key
+    matches. Candidates are scored by containment: the estimated share of the smaller
+    window's shingles found in the other one. Documents with a window scoring at least
+    threshold are returned. Band keys are kept in sorted arrays, and windows added after
+    the last compact() are scanned linearly until the next one.
+
+    With path set, the index is stored as index.npz plus added.jsonl, which holds the
+    documents added since the last save().
+    """
+    def __init__(self, path=None, num_perm=64, bands=16, shingle=5, threshold=0.5, chunk_size=1000, seed=1):
+        assert num_perm % bands == 0, "num_perm必须是bands的整数倍!"
+        self.path = path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle = shingle
+        self.threshold = threshold
+        self.chunk_size = chunk_size
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+        self.band_mult = rng.integers(1, 2**63, size=self.rows, dtype=np.uint64) | np.uint64(1)
+        self.ids = []
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self.sizes = np.zeros(0, dtype=np.int64)
+        self.keys = np.zeros((0, bands), dtype=np.uint64)
+        self.sorted_keys = np.zeros((bands, 0), dtype=np.uint64)
+        self.sorted_rows = np.zeros((bands, 0), dtype=np.int64)
+        self.pending_signatures = []
+        self.pending_sizes = []
+        self.pending_keys = []
+
+    def sketch(self, text):
+        """Return (signature, number of distinct shingles) of text."""
+        hashes = shingle_hashes(text, self.shingle)
+        if len(hashes) == 0:
+            return np.full(self.num_perm, 0xFFFFFFFF, dtype=np.uint32), 0
+        values = np.multiply.outer(hashes, self.a)
+        values += self.b
+        return (values.min(axis=0) >> np.uint64(32)).astype(np.uint32), len(hashes)
+
+    def band_keys(self, signatures):
+        signatures = signatures.reshape(-1, self.bands, self.rows).astype(np.uint64)
+        return (signatures * self.band_mult).sum(axis=2)
+
+    def __len__(self):
+        """Number of distinct documents."""
+        return len(set(self.ids))
+
+    def add(self, doc_id, text, persist=True):
+        for chunk in split_chunks(text, self.chunk_size):
+            signature, size = self.sketch(chunk)
+            self.add_signature(doc_id, signature, size, persist)
+
+    def add_signature(self, doc_id, signature, size, persist=True):
+        self.ids.append(doc_id)
+        self.pending_signatures.append(signature)
+        self.pending_sizes.append(size)
+        self.pending_keys.append(self.band_keys(signature)[0])
+        if persist and self.path:
+            with jsonlines.open(os.path.join(self.path, "added.jsonl"), 'a') as f:
+                f.write({"id":doc_id,"signature":signature.tolist(),"size":size})
+        if len(self.pending_signatures) >= 4096:
+            self.compact()
+
+    def add_many(self, items):
+        """Bulk add (doc_id, text) pairs. Nothing is persisted until save()."""
+        for doc_id, text in items:
+            for chunk in split_chunks(text, self.chunk_size):
+                signature, size = self.sketch(chunk)
+                self.ids.append(doc_id)
+                self.pending_signatures.append(signature)
+                self.pending_sizes.append(size)
+        if len(self.pending_keys) < len(self.pending_signatures):
+            new = np.array(self.pending_signatures[len(self.pending_keys):], dtype=np.uint32)
+            self.pending_keys += list(self.band_keys(new))
+        self.compact()
+
+    def compact(self):
+        if len(self.pending_signatures) == 0:
+            return
+        self.signatures = np.vstack([self.signatures, np.array(self.pending_signatures, dtype=np.uint32)])
+        self.sizes = np.concatenate([self.sizes, np.array(self.pending_sizes, dtype=np.int64)])
+        self.keys = np.vstack([self.keys, np.array(self.pending_keys, dtype=np.uint64)])
+        self.pending_signatures = []
+        self.pending_sizes = []
+        self.pending_keys = []
+        self.sorted_rows = np.argsort(self.keys, axis=0, kind="stable").T
+        self.sorted_keys = np.take_along_axis(self.keys, self.sorted_rows.T, axis=0).T
+
+    def query(self, text, exclude=None):
+        """Return [(doc_id, similarity)] of near-duplicates of text, most similar first.
+
+        text is cut into windows like the indexed documents, and every document keeps the
+        best score of any pair of windows. Documents whose id starts with exclude (e.g. the
+        current work folder) are skipped.
+        """
+        best = {}
+        for chunk in split_chunks(text, self.chunk_size):
+            signature, size = self.sketch(chunk)
+            for doc_id, similarity in self.query_signature(signature, size, exclude):
+                best[doc_id] = max(best.get(doc_id, 0), similarity)
+        return sorted(best.items(), key=lambda item: -item[1])
+
+    def query_signature(self, signature, size, exclude=None):
+        keys = self.band_keys(signature)[0]
+        candidates = []
+        n_sorted = self.sorted_keys.shape[1]
+        for band in range(self.bands):
+            lo = np.searchsorted(self.sorted_keys[band], keys[band], side="left")
+            hi = np.searchsorted(self.sorted_keys[band], keys[band], side="right")
+            if hi > lo:
+                candidates.append(self.sorted_rows[band, lo:hi])
+        if len(self.pending_keys) > 0:
+            matched = (np.array(self.pending_keys, dtype=np.uint64) == keys).any(axis=1)
+            candidates.append(np.nonzero(matched)[0] + n_sorted)
+        if len(candidates) == 0:
+            return []
+        candidates = np.unique(np.concatenate(candidates))
+        if len(candidates) == 0:
+            return []
+        signatures = [self.signatures[i] if i < n_sorted else self.pending_signatures[i - n_sorted] for i in candidates]
+        sizes = np.array([self.sizes[i] if i < n_sorted else self.pending_sizes[i - n_sorted] for i in candidates], dtype=np.float64)
+        jaccard = (np.array(signatures, dtype=np.uint32) == signature).mean(axis=1)
+        intersection = jaccard * (sizes + size) / (1 + jaccard)
+        similarities = np.minimum(1, intersection / np.maximum(1, np.minimum(sizes, size)))
+        result = [(self.ids[i], float(s)) for i, s in zip(candidates, similarities) if s >= self.threshold]
+        if exclude:
+            result = [item for item in result if not item[0].startswith(exclude)]
+        return sorted(result, key=lambda item: -item[1])
+
+    def params(self):
+        return {"num_perm":self.num_perm,"bands":self.bands,"shingle":self.shingle,"threshold":self.threshold,"chunk_size":self.chunk_size,"seed":self.seed}
+
+    def save(self, path=None):
+        if path:
+            self.path = path
+        self.compact()
+        os.makedirs(self.path, exist_ok=True)
+        np.savez(os.path.join(self.path, "index.npz"), ids=np.array(self.ids, dtype=str), signatures=self.signatures, sizes=self.sizes, params=json.dumps(self.params()))
+        with open(os.path.join(self.path, "added.jsonl"), 'w', encoding='utf-8') as f:
+            pass
+
+    @classmethod
+    def load(cls, path, threshold=None):
+        data = np.load(os.path.join(path, "index.npz"))
+        params = json.loads(str(data["params"]))
+        if threshold is not None:
+            params["threshold"] = threshold
+        index = cls(path=path, **params)
+        index.ids = data["ids"].tolist()
+        index.signatures = data["signatures"]
+        index.sizes = data["sizes"]
+        index.keys = index.band_keys(index.signatures)
+        index.sorted_rows = np.argsort(index.keys, axis=0, kind="stable").T
+        index.sorted_keys = np.take_along_axis(index.keys, index.sorted_rows.T, axis=0).T
+        if os.path.exists(os.path.join(path, "added.jsonl")):
+            with jsonlines.open(os.path.join(path, "added.jsonl")) as f:
+                for item in f:
+                    index.add_signature(item["id"], np.array(item["signature"], dtype=np.uint32), item["size"], persist=False)
+        return index
+
+def iter_sampled(sampled_path):
+    for name in sorted(os.listdir(sampled_path)):
+        if not name.endswith(".txt"):
+            continue
+        with open(os.path.join(sampled_path, name), 'r', encoding='utf-8') as f:
+            yield os.path.join(sampled_path, name), f.read()
+
+def iter_work_folders(save_path):
+    if not os.path.exists(save_path):
+        return
+    for name in sorted(os.listdir(save_path)):
+        if name.startswith("generate_") and os.path.isdir(os.path.join(save_path, name)):
+            yield os.path.join(save_path, name)
+
+def iter_chapters(save_path):
+    """Accepted chapters of every work folder, read from log.jsonl, with the ids BaseWriter.accept_chapter() uses.
+
+    Records of rejected drafts carry a check field and are skipped. Older records
+    without a chapter field are numbered in order after the plan, which is logged first.
+    """
+    for work_folder in iter_work_folders(save_path):
+        if not os.path.exists(os.path.join(work_folder, "log.jsonl")):
+            continue
+        with jsonlines.open(os.path.join(work_folder, "log.jsonl")) as f:
+            records = [record for record in f if "check" not in record]
+        for i, record in enumerate(records):
+            if "chapter" in record:
+                chapter = record["chapter"]
+            elif i == 0:
+                continue
+            else:
+                chapter = i - 1
+            yield f"{work_folder}#{chapter}", record["output"]
+
+def iter_plans(save_path):
+    for work_folder in iter_work_folders(save_path):
+        if os.path.exists(os.path.join(work_folder, "plan.txt")):
+            with open(os.path.join(work_folder, "plan.txt"), 'r', encoding='utf-8') as f:
+                yield f"{work_folder}#plan", f.read()
+
+def build_indexes(config):
+    """Build the chapter and plan indexes from sampled_texts and every work folder under save_path."""
+    dedup_config = config.get("dedup") or {}
+    index_path = dedup_config.get("index_path", "dedup_index")
+    save_path = config.get("save_path", "generated_texts")
+    params = {key:dedup_config[key] for key in ("num_perm", "bands", "shingle", "threshold", "chunk_size") if key in dedup_config}
+    chapters = DedupIndex(os.path.join(index_path, "chapters"), **params)
+    sampled_path = dedup_config.get("sampled_path", "sampled_texts")
+    if os.path.exists(sampled_path):
+        chapters.add_many(iter_sampled(sampled_path))
+    chapters.add_many(iter_chapters(save_path))
+    chapters.save()
+    plans = DedupIndex(os.path.join(index_path, "plans"), **params)
+    plans.add_many(iter_plans(save_path))
+    plans.save()
+    print(f"已建立近似重复索引: 段落{len(chapters)}个, 大纲{len(plans)}个")
+    return {"chapters":chapters, "plans":plans}
+
+_indexes = {}
+
+def load_indexes(config):
+    """Load the indexes of config['dedup']['index_path'], building them on first use. Shared within a process."""
+    dedup_config = config.get("dedup") or {}
+    index_path = dedup_config.get("index_path", "dedup_index")
+    if index_path not in _indexes:
+        if os.path.exists(os.path.join(index_path, "chapters", "index.npz")) and os.path.exists(os.path.join(index_path, "plans", "index.npz")):
+            threshold = dedup_config.get("threshold")
+            _indexes[index_path] = {"chapters":DedupIndex.load(os.path.join(index_path, "chapters"), threshold),
+                                    "plans":DedupIndex.load(os.path.join(index_path, "plans"), threshold)}
+        else:
+            _indexes[index_path] = build_indexes(config)
+    return _indexes[index_path]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("重新建立近似重复索引")
+    parser.add_argument("-c","--config",type=str,default="configs/deepseek-r1.yaml",help="配置文件路径")
+    args = parser.parse_args()
+    with open(args.config,"r",encoding="utf-8") as f:
+        build_indexes(yaml.safe_load(f))